@@ -1,13 +1,16 @@
-from . import query
-from . import pdbutils
-from . import sse
-from . import smallprot
-from . import loop_sse
-from . import extend_sse
-from . import smallprot_config
-from . import logger
-from . import peputils
-from . import constant
-from . import plot
-from . import extract_master
-from . import struct_analysis
+import importlib
+
+# submodules are imported on first attribute access, so that e.g. 
+# `from smallprot import smallprot_config` does not load numpy, prody 
+# and qbits through every other submodule
+_SUBMODULES = ('query', 'pdbutils', 'sse', 'smallprot', 'loop_sse', 
+               'extend_sse', 'smallprot_config', 'logger', 'peputils', 
+               'constant', 'plot', 'extract_master', 'struct_analysis')
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+def __dir__():
+    return sorted(list(globals()) + list(_SUBMODULES))
@@ -4,6 +4,8 @@ import prody as pr
 import numpy as np
 from scipy.sparse import csr_matrix
 
+from smallprot import query
+
 #The method is kabasch_algorithm
 #https://en.wikipedia.org/wiki/Kabsch_algorithm
 def get_rot_trans(mob_coords, targ_coords):
@@ -243,7 +245,7 @@ def listdir_mac(path):
 ##########
 ##########
 
-def run_cluster(path, log, loop_query_win, outfile=None):
+def run_cluster(path, log, loop_query_win, outfile=None, cache_dir=None):
     if outfile:
         orig_out = sys.stdout
         sys.stdout = open(outfile, 'a')
@@ -253,9 +255,15 @@ def run_cluster(path, log, loop_query_win, outfile=None):
             continue
         loopsize = int(loopdir)
         print('gapLen =', loopdir)
+        loop_files = sorted([f for f in os.listdir(path + loopdir) 
+                             if f[-3:] == 'pdb'])
+        if cache_dir is not None:
+            key = query.cache_key([path + loopdir + '/' + f for f in loop_files], 
+                                  ('run_cluster', loopsize, loop_query_win))
+            if query.restore_cache(cache_dir, key, path + loopdir):
+                continue
         pdbs = list()
-        for f in [f for f in os.listdir(path + loopdir) 
-                  if f[-3:] == 'pdb']:
+        for f in loop_files:
             pdb = pr.parsePDB(path + loopdir + '/' + f)
             ca_sel = pdb.select('name CA')
             if len(ca_sel) == 2*loop_query_win + loopsize:
@@ -275,5 +283,9 @@ def run_cluster(path, log, loop_query_win, outfile=None):
             else:
                 log.info('loop run_cluster error.')
                 log.info('The path: (' + path + loopdir + '/clusters/' +  ') already exist.')
+        # do not cache failed or empty clusterings, so they are retried
+        clusters_dir = path + loopdir + '/clusters/'
+        if cache_dir is not None and os.path.isdir(clusters_dir) and len(os.listdir(clusters_dir)) > 0:
+            query.save_cache(cache_dir, key, path + loopdir, ['clusters'])
     if outfile:
         sys.stdout = orig_out
@@ -1,7 +1,27 @@
+import os
+import re
 import numpy as np
+from functools import lru_cache
 import qbits
 
+# loop pdbs from MASTER end with e.g. '_wgap12.pdb.gz' or '_match12.pdb.gz'
+_LOOP_IDX_RE = re.compile(r'(\d+)\.pdb(?:\.gz)?$')
+
 def _get_seq_rmsd(seqfile):
+    '''
+    Get the residue names of each seq and the rmsds in a MASTER seq.txt.
+    The parse is memoized in memory per seqfile and modification time.
+    '''
+    all_seqs, all_rmsds = _load_seq_rmsd(seqfile, os.stat(seqfile).st_mtime_ns)
+    # copies, so callers never mutate the memoized parse
+    return [list(seq) for seq in all_seqs], list(all_rmsds)
+
+@lru_cache(maxsize=128)
+def _load_seq_rmsd(seqfile, mtime_ns):
+    all_seqs, all_rmsds = _parse_seq_rmsd(seqfile)
+    return tuple(tuple(seq) for seq in all_seqs), tuple(all_rmsds)
+
+def _parse_seq_rmsd(seqfile):
     with open(seqfile, 'r') as f:
         lines = f.read().split('\n')
     all_seqs = []
@@ -27,23 +47,25 @@ def _get_loop_candidate_seqs_one_letter(seqs):
         seqs_one_letter.append(''.join([qbits.constants.one_letter_code[res] for res in s]))
     return seqs_one_letter
 
+def _get_loop_pdb_idxs(loop_pdbs):
+    '''
+    Get the 0-based index into match.txt/seq.txt of each loop pdb from its filename.
+    '''
+    return [int(_LOOP_IDX_RE.search(loop_pdb).group(1)) - 1 for loop_pdb in loop_pdbs]
+
 def _get_pdbs_master_info(matchfile, seqfile, loop_pdbs):
-    with open(matchfile, 'r') as f:
-        ## A possible bug.
-        # rmsds = [float([val for val in line.split(' ') if val != ''][0]) 
-        #             for line in f.read().split('\n') if len(line) > 0]
-        all_pdss = [[val for val in line.split('/') if '.pds' in val][0] 
-                    for line in f.read().split('\n') if len(line) > 0]
+    ## A possible bug.
+    # rmsds = [float([val for val in line.split(' ') if val != ''][0]) 
+    #             for line in f.read().split('\n') if len(line) > 0]
+    # the second column of match.txt is the path of the matched pds file
+    all_pdss = [os.path.basename(path) for path in 
+                np.loadtxt(matchfile, usecols=(1,), dtype=str, comments=None, ndmin=1)]
     all_seqs, all_rmsds = _get_seq_rmsd(seqfile)
 
     loop_rmsds = []
     loop_seqs = []
     loop_pdss = []
-    for loop_pdb in loop_pdbs:
-        if 'wgap' in loop_pdb:
-            idx = int(loop_pdb.split('_')[-1][4:-7]) - 1
-        else:
-            idx = int(loop_pdb.split('_')[-1][5:-7]) - 1
+    for idx in _get_loop_pdb_idxs(loop_pdbs):
         loop_rmsds.append(all_rmsds[idx])
         loop_seqs.append(all_seqs[idx])
         loop_pdss.append(all_pdss[idx])
@@ -1,6 +1,5 @@
 import os
 import sys
-import gzip
 import string
 import shutil
 import numpy as np
@@ -9,11 +8,11 @@ import prody as pr
 from datetime import datetime 
 from multiprocessing import Pool, Manager
 from dataclasses import dataclass
+from collections import defaultdict
 import logomaker
 import matplotlib.pyplot as plt
 import pandas as pd
 
-from scipy.stats import mode
 from scipy.spatial.distance import cdist
 from itertools import product, permutations
 
@@ -22,6 +21,129 @@ import qbits
 from smallprot import pdbutils, query, cluster_loops, smallprot_config
 from smallprot import logger, peputils, constant, plot, extract_master, struct_analysis
 
+#Names of the loop length directories under a loops_X_Y workdir.
+_LOOP_LEN_DIRS = set(str(n) for n in range(100))
+
+def _loop_names(n_chains):
+    '''
+    Table of loop directory names, _loop_names(n)[j][k] == 'loops_{J}_{K}' for chains j, k.
+    '''
+    labels = string.ascii_uppercase[:n_chains]
+    return [['loops_{}_{}'.format(a, b) for b in labels] for a in labels]
+
+def _write_one_looped_pdb(the_full_sse_list, n_chains, rank, centroids, p, score, loop_workdir, para):
+    '''
+    Connect the sses with one loop combination and write the looped pdb.
+    Return None if the loops clash, otherwise (info, outdir, centroids).
+    '''
+    clashing = pdbutils.check_clashes(centroids)
+    if clashing:
+        return None
+
+    outdir = loop_workdir + '/loop_' + '-'.join([str(s) for s in p]) 
+    os.makedirs(outdir, exist_ok=True)
+
+    structs, slices = _connect_loops_struct(the_full_sse_list, n_chains, p, centroids, para.loop_query_win, para.construct_keep)
+    out_pdb = 'output_' + '-'.join(str(v) for v in p) + '_' + str(rank) + '_' + str(score) + '.pdb'
+    out_pdb_path = outdir + '/' + out_pdb
+    pdbutils.merge_save_struct(out_pdb_path, structs, slices) 
+
+    info = out_pdb + '\t' + str(score) + '\t' + '\t'.join([os.path.basename(c) for c in centroids])
+    return info, outdir, centroids
+
+def _connect_loops_struct(_full_sse_list, n_chains, permutation, centroids, loop_query_win, keep=1):
+    '''
+    Put seed sses and loop candidates together and calculate the cut position for each.      
+    @ _full_sse_list: [string], list of sse path.
+    @ permutation: [int], list of direaction. for example [0, 1, 2, 3] means connect sses with order of [A, B C, D].
+    @ keep: keep == 0, keep min; keep == -1, keep loop; keep == 1, keep seed. 
+    '''
+    pdbs_to_combine = [''] * (2 * n_chains - 1)
+    pdbs_to_combine[::2] = [_full_sse_list[idx] for idx in permutation]
+    pdbs_to_combine[1::2] = centroids
+
+    inds = [[0,0] for i in range(len(pdbs_to_combine))]
+    for i in range(len(pdbs_to_combine)-1):
+        j = i + 1
+        # 
+        min_dist, min_dist_ind, qrep_nres = peputils.cal_aa_dist([pdbs_to_combine[i], pdbs_to_combine[j]], i%2==0, loop_query_win, keep)       
+        if i%2==0:          
+            inds[i][1] = min_dist_ind[0]
+            inds[j][0] = min_dist_ind[1]
+        else:
+            inds[i][1] = min_dist_ind[0]                
+            inds[j][0] = min_dist_ind[1]
+            inds[j][1] = qrep_nres[1]
+    #print('inds')
+    #print(inds)                     
+    slices = [] 
+    for d in inds:
+        slices.append(slice(d[0], d[1]))
+    structs = [pdbutils.get_struct('test_' + str(i), pdbs_to_combine[i]) for i in range(len(pdbs_to_combine))]
+    return structs, slices
+
+def _loop_search_one_pair(_full_sse_list, trunc, loop_workdir, j, k, loop_range, para, log, cache_dir):
+    '''
+    Search and cluster the loops from SSE j to SSE k in loop_workdir.
+    '''
+    print('Generating loops between SSEs {} ' 'and {}'.format(string.ascii_uppercase[j], string.ascii_uppercase[k]))
+    if not os.path.exists(loop_workdir):
+        os.makedirs(loop_workdir, exist_ok=True)
+    loop_query = loop_workdir + '/loop_query.pdb'
+    loop_outfile = loop_workdir + '/stdout'
+    # calculate how many residues are required for an overlap region 
+    # of length 10 Angstroms between the query SSEs and the loops
+    inds = [j,k]
+    pdbutils.gen_loop_query_win(_full_sse_list, loop_query, inds, trunc, para.loop_query_win)
+    # find loops with MASTER
+    # sort PDBs into directories by loop length
+    clusters_exist = _loop_search_query_search(loop_workdir, loop_query, loop_outfile, loop_range, para, cache_dir)
+    # cluster loops if the clusters do not already exist
+    if not clusters_exist:
+        cluster_loops.run_cluster(loop_workdir + '/', log, para.loop_query_win, outfile=loop_outfile, 
+                                  cache_dir=cache_dir)
+
+def _loop_search_query_search(loop_workdir, loop_query, loop_outfile, loop_range, para, cache_dir):
+    """find loops with MASTER"""
+    gapLen = str(loop_range[0]) + '-' + str(loop_range[1])
+    if not os.path.exists(loop_outfile):
+        print('Querying MASTER for loops of length {} to {}.'.format(
+                str(loop_range[0]), str(loop_range[1])))
+        query.master_query_loop(loop_query, para.loop_target_list, 
+                                rmsdCut=para.rmsdCut, topN=para.master_query_loop_top,
+                                gapLen=gapLen, outdir=loop_workdir, 
+                                outfile=loop_outfile, cache_dir=cache_dir)
+    clusters_exist = True
+    # one scandir pass over loop_workdir, then only in-memory lookups
+    entries = list(os.scandir(loop_workdir))
+    len_dirs = set(e.name for e in entries if e.is_dir())
+    print('Sorting loop PDBs by loop length.')
+    # bucket the PDBs by loop length first, then create each length 
+    # directory once and move its PDBs in one batch
+    buckets = defaultdict(list)
+    for entry in entries:
+        path = entry.name
+        if '.pdb' in path and 'loop_query' not in path:
+            # subtract query ends from loop length
+            l = pdbutils.count_residues(entry.path) - 2*para.loop_query_win
+            buckets[str(l)].append(entry)
+        elif path in _LOOP_LEN_DIRS and entry.is_dir():
+            clusters_path = entry.path + '/clusters'
+            if not os.path.isdir(clusters_path):
+                os.makedirs(clusters_path, exist_ok=True)
+                clusters_exist = False
+    for l, l_entries in buckets.items():
+        l_dir = loop_workdir + '/' + l
+        if l not in len_dirs:
+            os.makedirs(l_dir, exist_ok=True)
+            # a new length directory has no clusters yet, as in the scan above
+            if l in _LOOP_LEN_DIRS:
+                os.makedirs(l_dir + '/clusters', exist_ok=True)
+                clusters_exist = False
+        for entry in l_entries:
+            os.rename(entry.path, l_dir + '/' + entry.name)
+    return clusters_exist
+
 @dataclass
 class Struct_info:
     trunc_info: str
@@ -88,6 +210,8 @@ class Loop_sse:
         self.workdir = _workdir  
         self.loop_workdir = _workdir     
         self.loop_range = [self.para.min_loop_length, self.para.max_loop_length] 
+        #MASTER/Qbits/cluster outputs keyed by a hash of their inputs, reused across runs in the same workdir.
+        self._cache_dir = _workdir + '/.cache/'
         #--------------------------------
         self.n_truncations = []
         self.c_truncations = []
@@ -100,16 +224,15 @@ class Loop_sse:
         #--------------------------------
 
     def _prepare_pdbs(self, seed_pdb, query_pdb, exclusion_pdb, _workdir):
+        # b-factor marking atoms as having at least min_nbrs neighbors
+        log_nbrs = float(np.log(self.para.min_nbrs)) if self.para.min_nbrs > 0 else 0.
         # if necessary, split query pdb file into chains
         if query_pdb:
             query_chain_dir = _workdir + '/query_chains'
             if not os.path.exists(query_chain_dir):
                 os.mkdir(query_chain_dir)
-            pdbutils.split_pdb(query_pdb, query_chain_dir, set_bfac=np.log(self.para.min_nbrs))
-            self.query_sse_list = [query_chain_dir + '/' + f for f in 
-                                   os.listdir(query_chain_dir)
-                                   if 'chain_' in f]
-            self.query_sse_list.sort()
+            pdbutils.split_pdb(query_pdb, query_chain_dir, set_bfac=log_nbrs)
+            self.query_sse_list = pdbutils.list_chain_pdbs(query_chain_dir)
         else:
             self.query_sse_list = []
         # if necessary, prepare seed pdb files
@@ -119,16 +242,13 @@ class Loop_sse:
             if not os.path.exists(seed_chain_dir):
                 os.mkdir(seed_chain_dir)
             pdbutils.split_pdb(seed_pdb, seed_chain_dir)
-            self.full_sse_list = [seed_chain_dir + '/' + f for f in 
-                                  os.listdir(seed_chain_dir)
-                                  if 'chain_' in f]
-            self.full_sse_list.sort()
+            self.full_sse_list = pdbutils.list_chain_pdbs(seed_chain_dir)
             if query_pdb:
                 pdbutils.merge_pdbs([query_pdb, seed_pdb], _seed_pdb)
             else:
-                pdbutils.merge_pdbs([seed_pdb], _seed_pdb, set_bfac=np.log(self.para.min_nbrs))      
+                pdbutils.merge_pdbs([seed_pdb], _seed_pdb, set_bfac=log_nbrs)      
         elif query_pdb:
-            pdbutils.merge_pdbs([query_pdb], _seed_pdb, set_bfac=np.log(self.para.min_nbrs))
+            pdbutils.merge_pdbs([query_pdb], _seed_pdb, set_bfac=log_nbrs)
             self.full_sse_list = []
         self.seed_pdb = _seed_pdb        
         if not query_pdb and not seed_pdb:
@@ -137,7 +257,7 @@ class Loop_sse:
         if exclusion_pdb:
             _exclusion_pdb = _workdir + '/exclusion.pdb'
             pdbutils.merge_pdbs([_seed_pdb, exclusion_pdb], _exclusion_pdb, 
-                                set_bfac=np.log(self.para.min_nbrs))
+                                set_bfac=log_nbrs)
             self.orig_exclusion = exclusion_pdb
         else:
             _exclusion_pdb = _seed_pdb
@@ -255,92 +375,47 @@ class Loop_sse:
         output_cut = output_cut if len(combs) > output_cut else len(combs)
         inds = np.argsort(scores)[::-1][:output_cut]
 
+        #Each candidate is independent, test and write them in parallel. Results keep the rank order.
+        #The workers are module functions given only paths and para, so self is never pickled.
+        args = [(the_full_sse_list, n_chains, rank, [c.cent_pdb for c in combs[ind]], ps[ind], scores[ind], 
+                 self.loop_workdir, self.para) for rank, ind in enumerate(inds)]
+        n_workers = smallprot_config.pool_size(self.para, len(args))
+        if n_chains <= 2 or n_workers <= 1:
+            results = [_write_one_looped_pdb(*arg) for arg in args]
+        else:
+            with Pool(n_workers) as pool:
+                results = pool.starmap(_write_one_looped_pdb, args)
+
         looped_pdb_info = []
-        for rank in range(len(inds)):
-            ind = inds[rank]
-            comb = combs[ind]
-            p = ps[ind]
-            centroids = [c.cent_pdb for c in comb]
-            clashing = pdbutils.check_clashes(centroids)
-            if clashing:
+        for result in results:
+            if result is None:
                 continue
-
-            outdir = self.loop_workdir + '/loop_' + '-'.join([str(s) for s in p]) 
-            if not os.path.exists(outdir):
-                os.mkdir(outdir)
+            info, outdir, centroids = result
             for c in centroids:
                 dst_dir = outdir + '/' + c.split('/')[-1]
                 shutil.copy(c, dst_dir)
                 shutil.copy(c.split('.')[0] + '_info.png', dst_dir.split('.')[0] + '_info.png')
-
-            structs, slices = self._connect_loops_struct(the_full_sse_list, n_chains, p, centroids, self.para.construct_keep)
-            out_pdb = 'output_' + '-'.join(str(v) for v in p) + '_' + str(rank) + '_' + str(scores[ind]) + '.pdb'
-            out_pdb_path = outdir + '/' + out_pdb
-            pdbutils.merge_save_struct(out_pdb_path, structs, slices) 
-
-            looped_pdb_info.append(out_pdb + '\t' + str(scores[ind]) + '\t' + '\t'.join([os.path.basename(c) for c in centroids]))    
+            looped_pdb_info.append(info)
         ##TO DO
 
         self._write_looped_pdb_summary(self.workdir + '/summary_proteins.txt', looped_pdb_info) 
-   
+
     def new_loop_search_fast(self, _full_sse_list, sat, trunc, workdir, loop_range=[3, 20]):
         """#Find loops for each pair of nearby N- and C-termini. return slice_lengths?"""      
         n_chains = len(sat)
-        for j, k in product(range(n_chains), repeat=2):
-            # ensure selected SSEs satisfy the distance constraint
-            if not sat[j, k] or j == k:
-                continue
-            print('Generating loops between SSEs {} ' 'and {}'.format(string.ascii_uppercase[j], string.ascii_uppercase[k]))
-            loop_workdir = workdir + '/loops_{}_{}'.format(string.ascii_uppercase[j], string.ascii_uppercase[k])
-            if not os.path.exists(loop_workdir):
-                os.mkdir(loop_workdir)
-            loop_query = loop_workdir + '/loop_query.pdb'
-            loop_outfile = loop_workdir + '/stdout'
-            # calculate how many residues are required for an overlap region 
-            # of length 10 Angstroms between the query SSEs and the loops
-            inds = [j,k]
-            pdbutils.gen_loop_query_win(_full_sse_list, loop_query, inds, trunc, self.para.loop_query_win)
-            # find loops with MASTER
-            # sort PDBs into directories by loop length
-            clusters_exist = self._loop_search_query_search(loop_workdir, loop_query, loop_outfile, loop_range)
-            # cluster loops if the clusters do not already exist
-            if not clusters_exist:
-                cluster_loops.run_cluster(loop_workdir + '/', self.log, self.para.loop_query_win, outfile=loop_outfile)
-
-    def _loop_search_query_search(self, loop_workdir, loop_query, loop_outfile, loop_range):
-        """find loops with MASTER"""
-        gapLen = str(loop_range[0]) + '-' + str(loop_range[1])
-        if not os.path.exists(loop_outfile):
-            print('Querying MASTER for loops of length {} to {}.'.format(
-                    str(loop_range[0]), str(loop_range[1])))
-            query.master_query_loop(loop_query, self.para.loop_target_list, 
-                                    rmsdCut=self.para.rmsdCut, topN=self.para.master_query_loop_top,
-                                    gapLen=gapLen, outdir=loop_workdir, 
-                                    outfile=loop_outfile)
-        clusters_exist = True
-        loop_workdir_paths = os.listdir(loop_workdir)
-        print('Sorting loop PDBs by loop length.')
-        # sort PDBs into directories by loop length
-        for path in loop_workdir_paths:
-            if '.pdb' in path and 'loop_query' not in path:
-                with open(loop_workdir + '/' + path, 'r') as f:
-                    res_ids = set([int(line[23:26]) for line in 
-                                    f.read().split('\n') if 
-                                    line[:4] == 'ATOM'])
-                    # subtract query ends from loop length
-                    l = len(res_ids) - 2*self.para.loop_query_win
-                l_dir = loop_workdir + '/' + str(l)
-                # create a directory for the loop length if necessary
-                if str(l) not in loop_workdir_paths:
-                    os.mkdir(l_dir)
-                    loop_workdir_paths.append(str(l))
-                os.rename(loop_workdir + '/' + path, l_dir + '/' + os.path.basename(path))
-            elif os.path.basename(path) in [str(n) for n in range(100)]:
-                clusters_path = loop_workdir + '/' + path + '/clusters'
-                if not os.path.exists(clusters_path):
-                    os.mkdir(clusters_path)
-                    clusters_exist = False
-        return clusters_exist
+        loop_names = _loop_names(n_chains)
+        # ensure selected SSEs satisfy the distance constraint
+        args = [(_full_sse_list, trunc, workdir + '/' + loop_names[j][k], j, k, loop_range, 
+                 self.para, self.log, self._cache_dir) 
+                for j, k in product(range(n_chains), repeat=2) if sat[j, k] and j != k]
+        #Each pair writes only to its own loops_X_Y directory, so the pairs are searched in parallel.
+        n_workers = smallprot_config.pool_size(self.para, len(args))
+        if n_workers <= 1:
+            for arg in args:
+                _loop_search_one_pair(*arg)
+        else:
+            with Pool(n_workers) as pool:
+                pool.starmap(_loop_search_one_pair, args)
 
     def _get_top_cluster_summary(self, workdir, n_chains, cluster_count_cut, loop_range):
         '''
@@ -349,9 +424,18 @@ class Loop_sse:
         Plot the phi/psi, sequence logo, hydrophobicity.
         '''
         _infos = []
+        loop_names = _loop_names(n_chains)
         for p in permutations(range(n_chains), 2):          
-            loop_workdir = workdir + '/loops_{}_{}'.format(string.ascii_uppercase[p[0]], string.ascii_uppercase[p[1]])
+            loop_name = loop_names[p[0]][p[1]]
+            loop_workdir = workdir + '/' + loop_name
+            # list the loop length directories once instead of probing each length
+            try:
+                len_dirs = set(e.name for e in os.scandir(loop_workdir) if e.is_dir())
+            except FileNotFoundError:
+                continue
             for l in range(loop_range[0], loop_range[1] + 1):
+                if str(l) not in len_dirs:
+                    continue
                 subdir = loop_workdir + '/{}/clusters/1'.format(str(l))                 
                 try:
                     loop_pdbs = os.listdir(subdir)
@@ -362,20 +446,17 @@ class Loop_sse:
                     _cent_pdb = ''                  
                     #Copy centroid pdb and plot   
                     if len(loop_pdbs) >= cluster_count_cut:
-                        _cent_pdb_workdir = self.loop_workdir + '/loops_{}_{}'.format(string.ascii_uppercase[p[0]], string.ascii_uppercase[p[1]])        
-                        _cent = 'loops_{}_{}'.format(string.ascii_uppercase[p[0]], string.ascii_uppercase[p[1]]) + '_' \
+                        _cent_pdb_workdir = self.loop_workdir + '/' + loop_name
+                        _cent = loop_name + '_' \
                             + workdir.split('/')[-1] + '_rg' + str(l) + '_' + str(len(loop_pdbs))
                         _cent_pdb = _cent_pdb_workdir + '/' + _cent + '.pdb'    
-                        if not os.path.exists(_cent_pdb_workdir):
-                            os.mkdir(_cent_pdb_workdir)
+                        os.makedirs(_cent_pdb_workdir, exist_ok=True)
                         if self.para.select_min_rmsd_pdb:
                             in_pdb = subdir + '/' + loop_pdbs[np.argmin(loop_rmsds)]
                         else:
                             in_pdb = subdir + '/' + [lpdb for lpdb in loop_pdbs if 'centroid' in lpdb][0]
 
-                        with gzip.open(in_pdb, 'rb') as f_in:
-                            with open(_cent_pdb, 'wb') as f_out:
-                                shutil.copyfileobj(f_in, f_out)                  
+                        pdbutils.gunzip(in_pdb, _cent_pdb)
 
                         phi, psi, _sel_seq = struct_analysis.cal_phipsi(_cent_pdb)
                         plot._plot_all(_cent_pdb_workdir + '/' + _cent, loop_seqs, loop_rmsds, l, self.para.loop_query_win, phi, psi, _sel_seq)     
@@ -437,16 +518,16 @@ class Loop_sse:
         '''
         combs = []
         ps = []
-        for p in permutations(range(n_chains)):
-            if not np.all([sat[p[j], p[j+1]] for j in range(n_chains - 1)]):
-                continue
-            all_keys = []
-            for j in range(n_chains-1):
-                k = j+1
-                loop_key = 'loops_{}_{}'.format(string.ascii_uppercase[p[j]], string.ascii_uppercase[p[k]])
-                keys = [key for key in reduced_order_infos if loop_key in key.loop_info]
-                values = [v.clust_num for v in keys]
-                all_keys.append([keys[i] for i in np.argsort(values) if values[i] > cluster_count_cut])
+        # loops of each chain pair with enough members, by increasing cluster size. 
+        # Built once and shared by every path through that pair.
+        loop_names = _loop_names(n_chains)
+        pair_keys = {}
+        for j, k in permutations(range(n_chains), 2):
+            keys = [key for key in reduced_order_infos if loop_names[j][k] in key.loop_info]
+            values = [v.clust_num for v in keys]
+            pair_keys[(j, k)] = [keys[i] for i in np.argsort(values) if values[i] > cluster_count_cut]
+        for p in pdbutils.ham_paths(sat):
+            all_keys = [pair_keys[(p[j], p[j+1])] for j in range(n_chains-1)]
             if 0 in [len(v) for v in all_keys]:
                 continue
             for comb in product(*all_keys):
@@ -476,37 +557,6 @@ class Loop_sse:
                     return False
         return True
  
-    def _connect_loops_struct(self, _full_sse_list, n_chains, permutation, centroids, keep=1):
-        '''
-        Put seed sses and loop candidates together and calculate the cut position for each.      
-        @ _full_sse_list: [string], list of sse path.
-        @ permutation: [int], list of direaction. for example [0, 1, 2, 3] means connect sses with order of [A, B C, D].
-        @ keep: keep == 0, keep min; keep == -1, keep loop; keep == 1, keep seed. 
-        '''
-        pdbs_to_combine = [''] * (2 * n_chains - 1)
-        pdbs_to_combine[::2] = [_full_sse_list[idx] for idx in permutation]
-        pdbs_to_combine[1::2] = centroids
-
-        inds = [[0,0] for i in range(len(pdbs_to_combine))]
-        for i in range(len(pdbs_to_combine)-1):
-            j = i + 1
-            # 
-            min_dist, min_dist_ind, qrep_nres = peputils.cal_aa_dist([pdbs_to_combine[i], pdbs_to_combine[j]], i%2==0, self.para.loop_query_win, keep)       
-            if i%2==0:          
-                inds[i][1] = min_dist_ind[0]
-                inds[j][0] = min_dist_ind[1]
-            else:
-                inds[i][1] = min_dist_ind[0]                
-                inds[j][0] = min_dist_ind[1]
-                inds[j][1] = qrep_nres[1]
-        #print('inds')
-        #print(inds)                     
-        slices = [] 
-        for d in inds:
-            slices.append(slice(d[0], d[1]))
-        structs = [pdbutils.get_struct('test_' + str(i), pdbs_to_combine[i]) for i in range(len(pdbs_to_combine))]
-        return structs, slices
-      
     def _write_loop_summary(self, filename, loop_infos):
         '''
         Write information of all loops.
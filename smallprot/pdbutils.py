@@ -1,5 +1,8 @@
 import os
+import re
 import sys
+import gzip
+import shutil
 import string
 
 import numpy as np
@@ -7,16 +10,20 @@ import prody as pr
 import numba
 
 from scipy.linalg import toeplitz
-from scipy.spatial import Delaunay
+from scipy.spatial import Delaunay, cKDTree
 from scipy.spatial.distance import cdist
 from Bio.PDB import PDBParser, PDBIO, Select, Polypeptide
 import prody
 from qbits import convex_hull, pdb, clash
 from itertools import combinations
+from functools import lru_cache
 
 from smallprot import peputils
 
 parser = PDBParser(QUIET=True)
+# residue sequence number field (columns 23-26) of ATOM records. Only the record 
+# name is matched literally, so the scan does not depend on how the serial is padded.
+_ATOM_RESNUM_RE = re.compile(rb'(?m)^ATOM.{18}(.{4})')
 io = PDBIO()
 ppb = Polypeptide.PPBuilder()
 
@@ -288,6 +295,24 @@ def split_pdb(pdb_path, outdir, min_nbrs=0, set_bfac=None,
         io.save(outpath, select=NotDisorderedOrH())
     return outpaths
 
+
+def list_chain_pdbs(dir_path):
+    """List the chain PDB files written to a directory by split_pdb.
+
+    Parameters
+    ----------
+    dir_path : str
+        Path to directory containing chain_X.pdb files.
+
+    Returns
+    -------
+    chain_pdbs : list
+        Sorted paths to the chain PDB files in the directory.
+    """
+    with os.scandir(dir_path) as it:
+        return sorted(dir_path + '/' + entry.name for entry in it 
+                      if entry.name.startswith('chain_'))
+
 def gen_loop_query(pdb_paths, out_path, min_nbrs=0):
     """Generate a query PDB for MASTER loop searches given input structures.
 
@@ -374,13 +399,113 @@ def satisfied_termini(pdb_path, max_nc_dist):
         residues = list(chain.get_residues())
         n_term[i] = residues[0]['N'].get_coord()
         c_term[i] = residues[-1]['C'].get_coord()
-    # calculate distances between the N- and C-terminal atoms
-    dists = cdist(c_term, n_term)
-    # calculate and return the matrix of which distances exceed the threshold
-    sat = (dists < max_nc_dist).astype(int)
+    return _sat_termini(c_term, n_term, max_nc_dist)
+
+
+def satisfied_termini_list(pdb_paths, max_nc_dist, min_nbrs=0):
+    """Calculate satisfied_termini of the structure that merge_pdbs would 
+    write for a list of PDB files, without writing and re-parsing it.
+
+    Parameters
+    ----------
+    pdb_paths : list
+        List of paths to the PDB files for the structures, in chain order. 
+        Their termini are memoized on the path and modification time.
+    max_nc_dist : float
+        Maximum distance (in Angstroms) between an N- and C-terminus in 
+        order for the pair to be considered as "satisfied."
+    min_nbrs : int, optional
+        Minimum number of neighbors of residues to be included, as in 
+        merge_pdbs.
+
+    Returns
+    -------
+    sat : np.array [n_chains x n_chains]
+        Array of 0s and 1s indicating which C- (rows) and N- (columns)
+        termini are within max_nc_dist of one another.
+    """
+    termini = [_get_termini(pdb_path, os.stat(pdb_path).st_mtime_ns, min_nbrs) 
+               for pdb_path in pdb_paths]
+    n_term = np.vstack([t[0] for t in termini])
+    c_term = np.vstack([t[1] for t in termini])
+    return _sat_termini(c_term, n_term, max_nc_dist)
+
+
+@lru_cache(maxsize=4096)
+def _get_termini(pdb_path, mtime_ns, min_nbrs=0):
+    # positions of the N-terminal N atom and C-terminal C atom of each chain; 
+    # chains left without residues by min_nbrs are not written by merge_pdbs, 
+    # so they are skipped here as well
+    struct = get_struct('struct0', pdb_path, min_nbrs)
+    chains = [chain for chain in struct.get_chains() if len(chain) > 0]
+    n_term = np.zeros((len(chains), 3))
+    c_term = np.zeros((len(chains), 3))
+    for i, chain in enumerate(chains):
+        residues = list(chain.get_residues())
+        n_term[i] = residues[0]['N'].coord
+        c_term[i] = residues[-1]['C'].coord
+    return n_term, c_term
+
+
+@numba.jit(nopython=True, cache=True)
+def _sat_termini(c_term, n_term, max_nc_dist):
+    # matrix of which C- (rows) to N-terminus (columns) distances are within the threshold
+    n_chains = c_term.shape[0]
+    max_sq = max_nc_dist * max_nc_dist
+    sat = np.zeros((n_chains, n_chains), dtype=np.int64)
+    for i in range(n_chains):
+        for j in range(n_chains):
+            d_sq = 0.
+            for k in range(3):
+                d = c_term[i, k] - n_term[j, k]
+                d_sq += d * d
+            if d_sq < max_sq:
+                sat[i, j] = 1
     return sat
 
 
+def ham_paths(sat):
+    """Iterate over the orders of SSEs that can be connected end to end.
+
+    Equivalent to filtering permutations(range(n_chains)) for those p with 
+    sat[p[k], p[k+1]] for every k, but only ever extends partial orders 
+    along satisfied termini, so unsatisfiable branches are never enumerated.
+
+    Parameters
+    ----------
+    sat : np.array [n_chains x n_chains]
+        Array of 0s and 1s indicating which C- (rows) and N- (columns)
+        termini can be connected, as from satisfied_termini.
+
+    Yields
+    ------
+    p : tuple
+        Chain indices in connection order, in lexicographic order.
+    """
+    n_chains = len(sat)
+    if n_chains == 0:
+        yield ()
+        return
+    full = (1 << n_chains) - 1
+    succ = [[int(k) for k in np.flatnonzero(sat[j]) if k != j] for j in range(n_chains)]
+    # a path has one start and one end, so at most one chain may lack 
+    # an incoming and at most one an outgoing connection
+    n_in = np.zeros(n_chains, dtype=int)
+    for j in range(n_chains):
+        n_in[succ[j]] += 1
+    if np.sum(n_in == 0) > 1 or sum(len(s) == 0 for s in succ) > 1:
+        return
+    stack = [((j,), 1 << j) for j in reversed(range(n_chains))]
+    while len(stack) > 0:
+        path, visited = stack.pop()
+        if visited == full:
+            yield path
+            continue
+        for k in reversed(succ[path[-1]]):
+            if not visited & (1 << k):
+                stack.append((path + (k,), visited | (1 << k)))
+
+
 def stitch(pdb_paths, out_path, overlaps=7, min_nbrs=0, 
            seq_replace=None, from_closest=False):
     """Stitch together the structures in a list of 1-chain PDB files.
@@ -569,6 +694,53 @@ def tri_v_and_a(xyz, simplices, faces):
     return V, A
 
 
+def parse_pdb(pdb_path):
+    """Parse a PDB file with ProDy, memoized on the path and modification time.
+
+    Parameters
+    ----------
+    pdb_path : str
+        Path to PDB file to be parsed.
+
+    Returns
+    -------
+    atoms : prody.AtomGroup
+        The parsed structure. It is a copy of the memoized parse, so it 
+        can be modified.
+    """
+    return _parse_pdb(pdb_path, os.stat(pdb_path).st_mtime_ns).copy()
+
+
+@lru_cache(maxsize=128)
+def _parse_pdb(pdb_path, mtime_ns):
+    return pr.parsePDB(pdb_path)
+
+
+# Upper bound (in Angstroms) on the interatomic distance FastClash can call a clash.
+_CONTACT_DIST = 5.
+
+
+def _atoms_within(xyz0, xyz1, dist):
+    # whether any atom of xyz0 is within dist of any atom of xyz1
+    if len(xyz0) + len(xyz1) > 500:
+        return cKDTree(xyz1).query_ball_point(xyz0, dist, return_length=True).any()
+    return _any_within(xyz0, xyz1, dist * dist)
+
+
+@numba.jit(nopython=True, cache=True)
+def _any_within(xyz0, xyz1, max_sq):
+    # squared-distance scan that returns at the first pair closer than sqrt(max_sq)
+    for i in range(xyz0.shape[0]):
+        for j in range(xyz1.shape[0]):
+            d_sq = 0.
+            for k in range(3):
+                d = xyz0[i, k] - xyz1[j, k]
+                d_sq += d * d
+            if d_sq < max_sq:
+                return True
+    return False
+
+
 def check_clashes(pdb_paths, res_ids_to_keep=[]):
     """Check whether there are steric clashes in a list of protein structures.
 
@@ -589,8 +761,8 @@ def check_clashes(pdb_paths, res_ids_to_keep=[]):
     clashing = False
     # check clashes between structures pairwise
     for pair in combinations(pdb_paths, 2):
-        atoms0 = pr.parsePDB(pair[0])
-        atoms1 = pr.parsePDB(pair[1])
+        atoms0 = parse_pdb(pair[0])
+        atoms1 = parse_pdb(pair[1])
         sel0 = ('name CA C O N H HA HA2 HA2 '
                 'CB HB3 HB2 HB1 HB 1HB 2HB 3HB')
         sel1 = sel0
@@ -608,6 +780,9 @@ def check_clashes(pdb_paths, res_ids_to_keep=[]):
                 sel1 += ' or resnum {}'.format(' '.join(ritk1))
         atoms0 = atoms0.select('protein').select(sel0)
         atoms1 = atoms1.select('protein').select(sel1)
+        # structures with no atoms in contact range cannot clash, skip the full check
+        if not _atoms_within(atoms0.getCoords(), atoms1.getCoords(), _CONTACT_DIST):
+            continue
         pdb0 = pdb.PDB(atoms0)
         pdb1 = pdb.PDB(atoms1)
         cla = clash.FastClash(pdb0, pdb1, copy_pq=False, noH=False)
@@ -619,6 +794,42 @@ def check_clashes(pdb_paths, res_ids_to_keep=[]):
     return clashing
 
 
+def gunzip(gz_path, out_path):
+    """Decompress a gzipped file (e.g. a .pdb.gz loop) to out_path.
+
+    Parameters
+    ----------
+    gz_path : str
+        Path to the gzipped file.
+    out_path : str
+        Path to the decompressed output file.
+    """
+    with gzip.open(gz_path, 'rb') as f_in:
+        with open(out_path, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out, length=1<<20)
+
+
+def count_residues(pdb_path):
+    """Count the distinct residue numbers among the ATOM records of a PDB file.
+
+    Parameters
+    ----------
+    pdb_path : str
+        Path to PDB file to be analyzed.
+
+    Returns
+    -------
+    n_res : int
+        Number of distinct residue numbers.
+    """
+    with open(pdb_path, 'rb') as f:
+        # hint the kernel to read ahead; posix_fadvise does not exist on macOS
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        data = f.read()
+    return len(set(_ATOM_RESNUM_RE.findall(data)))
+
+
 def check_gaps(pdb_path):
     """Check if any gaps larger than 2 Angstroms exist in the backbone.
 
@@ -4,24 +4,30 @@ from smallprot import pdbutils, query, cluster_loops, smallprot_config, logger
 import prody as pr
 
 backbone = ['N', 'CA', 'C', 'O']
+_backbone_set = frozenset(backbone)
 
 def cal_cdist(sse_list):
     '''
     compute interatomic distance between SSE pairs
     '''
-    qrep_xyz = []
+    qrep_atoms = []
     qrep_natoms = [0]
     qrep_nres = []
 
     for j, pair_qrep in enumerate(sse_list):
         title = 'struct{}'.format(str(j))
         this_struct = pdbutils.get_struct(title, pair_qrep, 1)
-        atoms = this_struct.get_atoms()
-        qrep_xyz.append(np.array([atom.get_coord() for atom in atoms if atom.get_name() in backbone]))            
-        qrep_nres.append(int(len(qrep_xyz[-1])/4))
-        qrep_natoms.append(qrep_natoms[-1] + len(qrep_xyz[-1]))
-
-    qrep_xyz = np.vstack(qrep_xyz)   
+        qrep_atoms.append([atom for atom in this_struct.get_atoms() if atom.get_name() in _backbone_set])
+        qrep_nres.append(int(len(qrep_atoms[-1])/4))
+        qrep_natoms.append(qrep_natoms[-1] + len(qrep_atoms[-1]))
+
+    # fill one preallocated buffer instead of building and stacking an array per SSE
+    qrep_xyz = np.empty((qrep_natoms[-1], 3), dtype=np.float32)
+    i = 0
+    for atoms in qrep_atoms:
+        for atom in atoms:
+            qrep_xyz[i] = atom.coord
+            i += 1
     dists = cdist(qrep_xyz, qrep_xyz)
     return qrep_natoms, qrep_nres, dists
 
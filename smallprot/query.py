@@ -1,12 +1,90 @@
 import os
 import shlex
 import shutil
+import tarfile
+import hashlib
 import subprocess
 
 import qbits
 
+def cache_key(paths, params):
+    """Hash the contents of input files and a set of parameters.
+
+    Parameters
+    ----------
+    paths : list
+        Paths to the input files whose contents determine the output.
+    params : tuple
+        Parameters that determine the output. Must have a stable repr.
+
+    Returns
+    -------
+    key : str
+        Hex digest identifying the inputs.
+    """
+    h = hashlib.blake2b()
+    for path in paths:
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    h.update(repr(params).encode())
+    return h.hexdigest()
+
+
+def restore_cache(cache_dir, key, outdir):
+    """Extract cached output files into outdir.
+
+    Returns
+    -------
+    hit : bool
+        True if the cache held an entry for key.
+    """
+    if cache_dir is None:
+        return False
+    tar_path = os.path.join(cache_dir, key + '.tar')
+    if not os.path.exists(tar_path):
+        return False
+    with tarfile.open(tar_path, 'r') as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(outdir, filter='data')
+        else:
+            # Pythons without extraction filters: only accept plain files 
+            # and directories that stay inside outdir
+            root = os.path.realpath(outdir)
+            for member in tar.getmembers():
+                dest = os.path.realpath(os.path.join(root, member.name))
+                if not (member.isfile() or member.isdir()) or \
+                   os.path.commonpath([root, dest]) != root:
+                    raise tarfile.TarError('Unsafe cache member {} in {}'.format(member.name, tar_path))
+            tar.extractall(outdir)
+    return True
+
+
+def save_cache(cache_dir, key, outdir, names):
+    """Archive the output files (or directories) names, relative to outdir, 
+    into the cache under key."""
+    if cache_dir is None:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    tar_path = os.path.join(cache_dir, key + '.tar')
+    # write to a temporary file first so concurrent readers never see a partial archive
+    tmp_path = tar_path + '.' + str(os.getpid())
+    with tarfile.open(tmp_path, 'w') as tar:
+        for name in names:
+            if os.path.exists(os.path.join(outdir, name)):
+                tar.add(os.path.join(outdir, name), arcname=name)
+    os.replace(tmp_path, tar_path)
+
+
+def _mtimes(dir_path):
+    # modification time (ns) of each file in dir_path, empty if it does not exist
+    if not os.path.isdir(dir_path):
+        return {}
+    with os.scandir(dir_path) as it:
+        return {entry.name: entry.stat().st_mtime_ns for entry in it}
+
+
 def master_query(pdb_path, targetList, rmsdCut=1., topN=None, 
-                 outfile=None, clobber=False):
+                 outfile=None, clobber=False, cache_dir=None):
     """Execute a MASTER query for a given PDB file.
 
     Parameters
@@ -24,6 +102,8 @@ def master_query(pdb_path, targetList, rmsdCut=1., topN=None,
         Path to a file to which MASTER output should be redirected.
     clobber : bool, optional
         If True, clobber MASTER output if it already exists.
+    cache_dir : str, optional
+        Directory of cached MASTER outputs, keyed by the query and parameters.
     """
     cwd = os.getcwd()
     pdb_path = os.path.realpath(pdb_path)
@@ -31,15 +111,22 @@ def master_query(pdb_path, targetList, rmsdCut=1., topN=None,
     if not clobber:
         if os.path.exists(pdb_dir + '/match.txt'):
             return
+    pre, ext = os.path.splitext(pdb_path)
+    pds_path = pre + '.pds'
+    cache_names = [os.path.basename(pds_path), 'match.txt', 'seq.txt']
+    if cache_dir is not None:
+        # the targetList mtime stands in for the database it lists
+        key = cache_key([pdb_path], ('master_query', targetList, 
+                                     os.stat(targetList).st_mtime_ns, rmsdCut, topN))
+        if restore_cache(cache_dir, key, pdb_dir):
+            return
     os.chdir(pdb_dir)
     cmd = 'createPDS --type query --pdb {}'.format(os.path.basename(pdb_path))
     if outfile:
         with open(outfile, 'a') as f:
-            subprocess.run(shlex.split(cmd), stdout=f)
+            pds_ret = subprocess.run(shlex.split(cmd), stdout=f).returncode
     else:
-        subprocess.run(shlex.split(cmd))
-    pre, ext = os.path.splitext(pdb_path)
-    pds_path = pre + '.pds'
+        pds_ret = subprocess.run(shlex.split(cmd)).returncode
     if topN is not None:
         cmd = ('master --query {} --targetList {} --topN {} --rmsdCut {} '
                '--seqOut seq.txt --matchOut match.txt').format(pds_path, 
@@ -61,20 +148,25 @@ def master_query(pdb_path, targetList, rmsdCut=1., topN=None,
                     parent_seed = parent_dir + '/seed.pdb'
                     break
         parent_dir = os.path.dirname(parent_dir)
+    master_ret = 0
     if parent_seed is not None:
         for filename in ['/seed.pds', '/match.txt', '/seq.txt']:
             shutil.copyfile(parent_dir + filename, pdb_dir + filename)
     else:
         if outfile:
             with open(outfile, 'a') as f:
-                subprocess.run(shlex.split(cmd), stdout=f)
+                master_ret = subprocess.run(shlex.split(cmd), stdout=f).returncode
         else:
-            subprocess.run(shlex.split(cmd))
+            master_ret = subprocess.run(shlex.split(cmd)).returncode
+    # only cache complete runs, so that a failed MASTER run is retried
+    if cache_dir is not None and pds_ret == 0 and master_ret == 0 \
+       and os.path.exists(pdb_dir + '/match.txt'):
+        save_cache(cache_dir, key, pdb_dir, cache_names)
     os.chdir(cwd)
 
 
 def master_query_loop(pdb_path, targetList, rmsdCut=1., gapLen=10,  
-                      topN=None, outdir=None, outfile=None):
+                      topN=None, outdir=None, outfile=None, cache_dir=None):
     """Execute a MASTER query for a given PDB file.
 
     Parameters
@@ -94,19 +186,29 @@ def master_query_loop(pdb_path, targetList, rmsdCut=1., gapLen=10,
         Directory in which to output PDB files for loop structures.
     outfile : str, optional
         Path to a file to which MASTER output should be redirected.
+    cache_dir : str, optional
+        Directory of cached MASTER outputs, keyed by the query and parameters.
     """
     cwd = os.getcwd()
     pdb_path = os.path.realpath(pdb_path)
     pdb_dir = os.path.dirname(pdb_path)
+    if not outdir:
+        outdir = 'loops_' + str(gapLen)
+    if cache_dir is not None:
+        key = cache_key([pdb_path], ('master_query_loop', targetList, 
+                                     os.stat(targetList).st_mtime_ns, rmsdCut, gapLen, topN))
+        if restore_cache(cache_dir, key, pdb_dir):
+            return
     os.chdir(pdb_dir)
     cmd = 'createPDS --type query --pdb {}'.format(os.path.basename(pdb_path))
     if outfile:
         with open(outfile, 'a') as f:
-            subprocess.run(shlex.split(cmd), stdout=f)
+            pds_ret = subprocess.run(shlex.split(cmd), stdout=f).returncode
     else:
-        subprocess.run(shlex.split(cmd))
-    if not outdir:
-        outdir = 'loops_' + str(gapLen)
+        pds_ret = subprocess.run(shlex.split(cmd)).returncode
+    # the loop pdbs written by MASTER are the files in outdir that are new 
+    # or were overwritten, so record the modification time of each file
+    outdir_before = _mtimes(outdir)
     pre, ext = os.path.splitext(pdb_path)
     pds_path = pre + '.pds'
     if topN is not None:
@@ -125,15 +227,25 @@ def master_query_loop(pdb_path, targetList, rmsdCut=1., gapLen=10,
                                         outdir)
     if outfile:
         with open(outfile, 'a') as f:
-            subprocess.run(shlex.split(cmd), stdout=f)
+            master_ret = subprocess.run(shlex.split(cmd), stdout=f).returncode
     else:
-        subprocess.run(shlex.split(cmd))
+        master_ret = subprocess.run(shlex.split(cmd)).returncode
+    # only cache complete runs, so that a failed MASTER run is retried
+    if cache_dir is not None and pds_ret == 0 and master_ret == 0 \
+       and os.path.exists(pdb_dir + '/match.txt'):
+        outdir_rel = os.path.relpath(os.path.realpath(outdir), pdb_dir)
+        cache_names = set([os.path.basename(pds_path), 'match.txt', 'seq.txt'])
+        cache_names.update(os.path.normpath(os.path.join(outdir_rel, f)) 
+                           for f, mtime_ns in _mtimes(outdir).items() 
+                           if outdir_before.get(f) != mtime_ns)
+        save_cache(cache_dir, key, pdb_dir, sorted(cache_names))
     os.chdir(cwd)
 
 
 def qbits_search(query_pdb_path, query_full_pdb_path, chains_dict_path, 
                  outdir, window_size=10, rmsd=1.5, top=5, sec_struct=None, 
-                 antiparallel=False, min_nbrs=1, contiguous=False):
+                 antiparallel=False, min_nbrs=1, contiguous=False, 
+                 cache_dir=None):
     """Parse MASTER matches and search for neighbors to generate qbit reps.
 
     Parameters
@@ -162,12 +274,20 @@ def qbits_search(query_pdb_path, query_full_pdb_path, chains_dict_path,
         Qbit reps.
     contiguous : bool, optional
         If True, limit to contiguous qbit reps.
+    cache_dir : str, optional
+        Directory of cached qbit reps, keyed by the query and parameters.
     """
     query_pdb_path = os.path.realpath(query_pdb_path)
     query_full_pdb_path = os.path.realpath(query_full_pdb_path)
     query_dir = os.path.dirname(query_pdb_path)
     match_path = query_dir + '/match.txt'
     seq_path = query_dir + '/seq.txt'
+    if cache_dir is not None:
+        key = cache_key([query_pdb_path, query_full_pdb_path, match_path, seq_path], 
+                        ('qbits_search', chains_dict_path, window_size, rmsd, top, 
+                         sec_struct, antiparallel, min_nbrs, contiguous))
+        if restore_cache(cache_dir, key, outdir):
+            return
     # parse MASTER matches
     p = qbits.parse.Parse(query_full_pdb_path, query_pdb_path, match_path, 
                           seq_path)
@@ -183,4 +303,5 @@ def qbits_search(query_pdb_path, query_full_pdb_path, chains_dict_path,
         qs.get_contiguous_qbit_reps(p, top=top, outdir=outdir + '/qbit_reps/')
     else:
         qs.get_qbit_reps(p, top=top, outdir=outdir + '/qbit_reps/')
-
+    if cache_dir is not None:
+        save_cache(cache_dir, key, outdir, ['qbit_reps'])
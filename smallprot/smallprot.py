@@ -16,9 +16,8 @@ import pandas as pd
 #from pyrosetta import rosetta
 
 
-from scipy.stats import mode
 from scipy.spatial.distance import cdist
-from itertools import product, permutations
+from itertools import product
 
 import qbits
 
@@ -34,7 +33,41 @@ class Protein_info:
     compactness: float
     sses: list = field(default_factory=list)
     median_min_dists: list = field(default_factory=list)
-    
+
+def _eval_final_protein(outdir, full_sse_list, workdir, para):
+    '''
+    Construct one final protein. Return (pdb copied to pre_build_pdbs, full_sse_list, info).
+    '''
+    #Merge the sses to generate the pdb.
+    folders = outdir.split('/')
+    filename = 'full'
+    for i in range(para.num_iter, 0, -1):
+        filename += '_' + folders[-i]
+    filename += '.pdb'
+    _full_pdb = outdir + '/' + filename
+    pdbutils.merge_pdbs(full_sse_list, _full_pdb, min_nbrs=para.min_nbrs)
+
+    #Filter final pdbs with limitations.
+    #COMMENT: Note that to use alpha_hull for the helix bundles, the helix must be cutted properly. 
+    #         Otherwise, the alpha_hull will be out of control.
+    ahull_in_ratio, volume, surface_area = struct_analysis.cal_ahull(_full_pdb)
+    # if ahull_in_ratio < 0.5:
+    #     return
+    distances = peputils.get_neighbor_dists(full_sse_list, list(range(len(full_sse_list))))
+
+    #Copy out pre_build_pdbs into one folder, so it is easy to analyze them together.
+    pre_build_workdir = workdir + '/pre_build_pdbs'
+    os.makedirs(pre_build_workdir, exist_ok=True)
+    _full_pdb_new = pre_build_workdir + '/' + filename
+    shutil.copyfile(_full_pdb, _full_pdb_new)
+
+    #sasa = self._cal_sasa(_full_pdb)
+    sasa = 0
+    compactness = pdbutils.calc_compactness(_full_pdb)
+    info = Protein_info(ahull_in_ratio = ahull_in_ratio, volume = volume, surface_area = surface_area, 
+        sasa = sasa, compactness = compactness, sses = full_sse_list, median_min_dists = distances)
+    return _full_pdb_new, full_sse_list, info
+
 
 
 class SmallProt:
@@ -88,6 +121,8 @@ class SmallProt:
         self.workdir = _workdir  
         self.loop_workdir = _workdir     
         self.loop_range = [self.para.min_loop_length, self.para.max_loop_length]
+        #MASTER/Qbits outputs keyed by a hash of their inputs, reused across runs in the same workdir.
+        self._cache_dir = _workdir + '/.cache/'
         self.targetList = os.path.realpath(self.para.database) + '/pds_list_2p5.txt'
         self.chains_dict = os.path.realpath(self.para.database) + '/db_2p5A_0p3rfree_chains_dictionary.pkl'
         #--------------------------------   
@@ -97,6 +132,9 @@ class SmallProt:
         self.pre_build_pdbs = []
         self.pre_full_sses = []
         self.pre_build_pdbs_summary = []
+        #--------------------------------
+        #Looped pdbs, to skip pdbs that were already looped.
+        self.looped_pdbs = []
 
         #pyrosetta.init(extra_options="-ignore_zero_occupancy false ") 
         #self.pose = pyrosetta.rosetta.core.pose.Pose()        
@@ -104,16 +142,15 @@ class SmallProt:
 
 
     def _prepare_pdbs(self, seed_pdb, query_pdb, exclusion_pdb, _workdir):
+        # b-factor marking atoms as having at least min_nbrs neighbors
+        log_nbrs = float(np.log(self.para.min_nbrs)) if self.para.min_nbrs > 0 else 0.
         # if necessary, split query pdb file into chains
         if query_pdb:
             query_chain_dir = _workdir + '/query_chains'
             if not os.path.exists(query_chain_dir):
                 os.mkdir(query_chain_dir)
-            pdbutils.split_pdb(query_pdb, query_chain_dir, set_bfac=np.log(self.para.min_nbrs))
-            self.query_sse_list = [query_chain_dir + '/' + f for f in 
-                                   os.listdir(query_chain_dir)
-                                   if 'chain_' in f]
-            self.query_sse_list.sort()
+            pdbutils.split_pdb(query_pdb, query_chain_dir, set_bfac=log_nbrs)
+            self.query_sse_list = pdbutils.list_chain_pdbs(query_chain_dir)
         else:
             self.query_sse_list = []
         # if necessary, prepare seed pdb files
@@ -123,16 +160,13 @@ class SmallProt:
             if not os.path.exists(seed_chain_dir):
                 os.mkdir(seed_chain_dir)
             pdbutils.split_pdb(seed_pdb, seed_chain_dir)
-            self.full_sse_list = [seed_chain_dir + '/' + f for f in 
-                                  os.listdir(seed_chain_dir)
-                                  if 'chain_' in f]
-            self.full_sse_list.sort()
+            self.full_sse_list = pdbutils.list_chain_pdbs(seed_chain_dir)
             if query_pdb:
                 pdbutils.merge_pdbs([query_pdb, seed_pdb], _seed_pdb)
             else:
-                pdbutils.merge_pdbs([seed_pdb], _seed_pdb, set_bfac=np.log(self.para.min_nbrs))      
+                pdbutils.merge_pdbs([seed_pdb], _seed_pdb, set_bfac=log_nbrs)      
         elif query_pdb:
-            pdbutils.merge_pdbs([query_pdb], _seed_pdb, set_bfac=np.log(self.para.min_nbrs))
+            pdbutils.merge_pdbs([query_pdb], _seed_pdb, set_bfac=log_nbrs)
             self.full_sse_list = []
         self.seed_pdb = _seed_pdb        
         if not query_pdb and not seed_pdb:
@@ -141,7 +175,7 @@ class SmallProt:
         if exclusion_pdb:
             _exclusion_pdb = _workdir + '/exclusion.pdb'
             pdbutils.merge_pdbs([_seed_pdb, exclusion_pdb], _exclusion_pdb, 
-                                set_bfac=np.log(self.para.min_nbrs))
+                                set_bfac=log_nbrs)
             self.orig_exclusion = exclusion_pdb
         else:
             _exclusion_pdb = _seed_pdb
@@ -164,10 +198,16 @@ class SmallProt:
 
     def _generate_proteins(self):     
         self.queues.append([self.seed_pdb, self.exclusion_pdb, self.full_sse_list, self.para.num_iter])
+        finals = []
         while len(self.queues) > 0:            
             queue = self.queues.pop(0)
             print('--Get queue--')
+            if queue[3] == 0:
+                #Final proteins do not add queues, so they are collected and constructed together below.
+                finals.append((os.path.dirname(queue[0]), queue[2]))
+                continue
             self._const_protein(queue[0], queue[1], queue[2], queue[3]) 
+        self._const_final_proteins(finals)
 
         print('Finish construct sses!')
         if len(self.pre_build_pdbs) > 0:   
@@ -198,6 +238,24 @@ class SmallProt:
                 self._add_seed_sse(i, qrep, j, seed_sse_list, full_sse_list, exclusion_pdb, recursion_order, outdir)
         return
    
+    def _const_final_proteins(self, finals):
+        '''
+        Construct the final proteins of a list of (outdir, full_sse_list).
+        Each writes only into its own outdir, so they are constructed in parallel. Results keep the list order.
+        '''
+        #Tasks carry only paths and para.
+        args = [(outdir, full_sse_list, self.workdir, self.para) for outdir, full_sse_list in finals]
+        n_workers = smallprot_config.pool_size(self.para, len(args))
+        if n_workers <= 1:
+            results = [_eval_final_protein(*arg) for arg in args]
+        else:
+            with Pool(n_workers) as pool:
+                results = pool.starmap(_eval_final_protein, args)
+        for pdb, full_sse_list, info in results:
+            self.pre_build_pdbs.append(pdb)
+            self.pre_full_sses.append(full_sse_list) 
+            self.pre_build_pdbs_summary.append(info)
+
     def _const_final_protein(self, outdir, full_sse_list):
         '''
         The smallprot building process is at the last step as the recursion_order == 0. 
@@ -205,38 +263,7 @@ class SmallProt:
         outdir : output path of the final_protein
         full_sse_list : all sses for the final protein
         '''
-        #Merge the sses to generate the pdb.
-        folders = outdir.split('/')
-        filename = 'full'
-        for i in range(self.para.num_iter, 0, -1):
-            filename += '_' + folders[-i]
-        filename += '.pdb'
-        _full_pdb = outdir + '/' + filename
-        pdbutils.merge_pdbs(full_sse_list, _full_pdb, min_nbrs=self.para.min_nbrs)
-
-        #Filter final pdbs with limitations.
-        #COMMENT: Note that to use alpha_hull for the helix bundles, the helix must be cutted properly. 
-        #         Otherwise, the alpha_hull will be out of control.
-        ahull_in_ratio, volume, surface_area = struct_analysis.cal_ahull(_full_pdb)
-        # if ahull_in_ratio < 0.5:
-        #     return
-        distances = peputils.get_neighbor_dists(full_sse_list, list(range(len(full_sse_list))))
-        
-        #Copy out pre_build_pdbs into one folder, so it is easy to analyze them together.
-        pre_build_workdir = self.workdir + '/pre_build_pdbs'
-        if not os.path.exists(pre_build_workdir):
-            os.mkdir(pre_build_workdir)
-        _full_pdb_new = pre_build_workdir + '/' + filename
-        shutil.copyfile(_full_pdb, _full_pdb_new)
-        
-        self.pre_build_pdbs.append(_full_pdb_new)
-        self.pre_full_sses.append(full_sse_list) 
-        #sasa = self._cal_sasa(_full_pdb)
-        sasa = 0
-        compactness = pdbutils.calc_compactness(_full_pdb)
-        info = Protein_info(ahull_in_ratio = ahull_in_ratio, volume = volume, surface_area = surface_area, 
-            sasa = sasa, compactness = compactness, sses = full_sse_list, median_min_dists = distances)
-        self.pre_build_pdbs_summary.append(info)
+        self._const_final_proteins([(outdir, full_sse_list)])
 
     # def _cal_sasa(self, full_pdb):
     #     self.pose = rosetta.core.import_pose.pose_from_file(full_pdb)      
@@ -255,11 +282,8 @@ class SmallProt:
         #     # the remaining number of iterations, exit the branch early
         #     return
         if n_sat >= self.para.num_iter:
-            try_loopgen = False
-            n_chains = len(sat)
-            for p in permutations(range(n_chains)):
-                if np.all([sat[p[k], p[k+1]] for k in range(n_chains - 1)]):
-                    try_loopgen = True
+            # loops can be built if some order of the SSEs connects them all
+            try_loopgen = next(pdbutils.ham_paths(sat), None) is not None
             if try_loopgen:
                 #I don't think this could avoid build same proteins. The chains of the protein have different order. 
                 with open(pdb, 'r') as f0:
@@ -282,9 +306,16 @@ class SmallProt:
         outfile = outdir + '/stdout'
         print('Querying MASTER')
         query.master_query(pdb, self.targetList, self.para.rmsdCut, 
-            topN=self.para.master_query_top, outfile=outfile, clobber=False)
+            topN=self.para.master_query_top, outfile=outfile, clobber=False, 
+            cache_dir=self._cache_dir)
         print('Searching with Qbits')
-        if not os.path.exists(outdir + '/qbit_reps/'):
+        # Qbits can only find reps if MASTER found matches for the query
+        match_path = os.path.dirname(os.path.realpath(pdb)) + '/match.txt'
+        feasible = os.path.exists(match_path) and os.path.getsize(match_path) > 0 \
+                   and os.path.exists(exclusion_pdb)
+        if not feasible:
+            self.log.warning('Skip qbits search of {}: no MASTER matches or missing exclusion pdb.'.format(pdb))
+        elif not os.path.exists(outdir + '/qbit_reps/'):
             try:
                 # ensure the second SSE is antiparallel to the first
                 #query_exists = int(bool(len(self.query_sse_list)))
@@ -297,12 +328,14 @@ class SmallProt:
                                    self.para.qbits_window, self.para.qbits_rmsd, 
                                    self.para.top, sec_struct=self.para.secstruct,
                                    antiparallel=first_recursion,
-                                   min_nbrs=self.para.min_nbrs, contiguous=True)
-            except:
-                pass
+                                   min_nbrs=self.para.min_nbrs, contiguous=True, 
+                                   cache_dir=self._cache_dir)
+            except Exception as e:
+                self.log.warning('Qbits search of {} failed: {!r}'.format(pdb, e))
         qreps = None
         if os.path.exists(outdir + '/qbit_reps/'):
-            qreps = [outdir + '/qbit_reps/' + pdb_path for pdb_path in os.listdir(outdir + '/qbit_reps/')]
+            with os.scandir(outdir + '/qbit_reps/') as it:
+                qreps = [outdir + '/qbit_reps/' + entry.name for entry in it]
         return qreps
 
     def _resize_qreps(self, qreps, full_sse_list, loop_query_win):
@@ -367,11 +400,6 @@ class SmallProt:
 
     def _add_seed_sse(self, i, qrep, j, seed_sse_list, full_sse_list, exclusion_pdb, recursion_order, outdir):
         """Add new queries into the self.queues."""
-        _workdir = '{}/{}'.format(outdir, str(i) + string.ascii_lowercase[j])
-        if not os.path.exists(_workdir):
-            os.mkdir(_workdir)
-        _seed_pdb = _workdir + '/seed.pdb'
-        pdbutils.merge_pdbs(seed_sse_list, _seed_pdb, min_nbrs=self.para.min_nbrs)
         _full_sse_list = full_sse_list.copy()
         _full_sse_list.append(qrep)
         print('SSE List:')
@@ -386,13 +414,22 @@ class SmallProt:
         # else:
         #     sat = pdbutils.satisfied_termini(_seed_pdb, self.para.max_nc_dist)
         #     _the_pdb = _seed_pdb
-        sat = pdbutils.satisfied_termini(_seed_pdb, self.para.max_nc_dist)
+        # computed from the (cached) termini of each SSE, so that seed.pdb 
+        # only has to be merged and written for branches that are kept
+        sat = pdbutils.satisfied_termini_list(seed_sse_list, self.para.max_nc_dist, 
+                                              min_nbrs=self.para.min_nbrs)
         n_sat = np.sum(sat)
         if self.para.num_iter - recursion_order + 1 > n_sat:
             # if it is impossible to satisfy all N- or C- termini within 
             # the remaining number of iterations, exit the branch early
             return
 
+        _workdir = '{}/{}'.format(outdir, str(i) + string.ascii_lowercase[j])
+        if not os.path.exists(_workdir):
+            os.mkdir(_workdir)
+        _seed_pdb = _workdir + '/seed.pdb'
+        pdbutils.merge_pdbs(seed_sse_list, _seed_pdb, min_nbrs=self.para.min_nbrs)
+
         if recursion_order > 0:
             _exclusion_pdb = _workdir + '/exclusion.pdb'
             pdbutils.merge_pdbs([exclusion_pdb, qrep], _exclusion_pdb, min_nbrs=self.para.min_nbrs)
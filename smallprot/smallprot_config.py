@@ -53,6 +53,9 @@ Parameters for Smallprot
     loop_target_list : str, optional
         Filename of target list within the database of objects to 
         be used in MASTER queries for loops.
+    num_workers : int, optional
+        Maximum number of worker processes for the parallel steps of the 
+        design. If None, one per cpu.
 '''
 
 class Parameter:
@@ -60,7 +63,7 @@ class Parameter:
     qbits_rmsd = 1.5, qbits_window = 10, secstruct = None, min_nbrs = 1, lowest_rmsd_loop = True, 
     database='/mnt/e/GitHub_Design/Qbits/database', loop_target_list='/mnt/e/GitHub_Design/master_db/list', 
     master_query_loop_top = 200, max_nc_dist = 15.0, loop_query_win =7, min_loop_length = 3, max_loop_length=20, select_min_rmsd_pdb = True,
-    cluster_count_cut=20, loop_distance_cut=15, construct_keep = 100):
+    cluster_count_cut=20, loop_distance_cut=15, construct_keep = 100, num_workers = None):
         self.num_iter = num_iter  
         self.top = top      
         self.master_query_top = master_query_top
@@ -84,6 +87,16 @@ class Parameter:
         self.cluster_count_cut=cluster_count_cut
         self.loop_distance_cut=loop_distance_cut
         self.construct_keep = construct_keep
+        ###For multiprocessing
+        self.num_workers = num_workers
+
+
+def pool_size(para, n_tasks):
+    '''
+    Number of worker processes for n_tasks independent tasks, at most para.num_workers (one per cpu if None).
+    '''
+    num_workers = para.num_workers if para.num_workers else os.cpu_count()
+    return max(1, min(num_workers, n_tasks))
 
 
 def writeConfig(filePath, para):
@@ -112,7 +125,8 @@ def writeConfig(filePath, para):
                         'select_min_rmsd_pdb': str(para.select_min_rmsd_pdb),
                         'cluster_count_cut': str(para.cluster_count_cut),
                         'loop_distance_cut': str(para.loop_distance_cut),
-                        'construct_keep': str(para.construct_keep)
+                        'construct_keep': str(para.construct_keep),
+                        'num_workers': str(para.num_workers)
                         }
 
     with open(filePath, 'w') as configfile:
@@ -148,6 +162,8 @@ def readConfig(filePath = 'parameter.ini'):
     para.cluster_count_cut = cfg.getint('Smallprot','cluster_count_cut')
     para.loop_distance_cut = cfg.getint('Smallprot','loop_distance_cut')
     para.construct_keep = cfg.getint('Smallprot', 'construct_keep')
+    num_workers = cfg.get('Smallprot', 'num_workers', fallback='None')
+    para.num_workers = int(num_workers) if num_workers!='None' else None
     return para
 
 
@@ -35,16 +35,15 @@ class SSE:
 
 
     def _prepare_pdbs(self, seed_pdb, query_pdb, exclusion_pdb, _workdir, min_nbrs):
+        # b-factor marking atoms as having at least min_nbrs neighbors
+        log_nbrs = float(np.log(min_nbrs)) if min_nbrs > 0 else 0.
         # if necessary, split query pdb file into chains
         if query_pdb:
             query_chain_dir = _workdir + '/query_chains'
             if not os.path.exists(query_chain_dir):
                 os.mkdir(query_chain_dir)
-            pdbutils.split_pdb(query_pdb, query_chain_dir, set_bfac=np.log(min_nbrs))
-            self.query_sse_list = [query_chain_dir + '/' + f for f in 
-                                   os.listdir(query_chain_dir)
-                                   if 'chain_' in f]
-            self.query_sse_list.sort()
+            pdbutils.split_pdb(query_pdb, query_chain_dir, set_bfac=log_nbrs)
+            self.query_sse_list = pdbutils.list_chain_pdbs(query_chain_dir)
         else:
             self.query_sse_list = []
         # if necessary, prepare seed pdb files
@@ -54,16 +53,13 @@ class SSE:
             if not os.path.exists(seed_chain_dir):
                 os.mkdir(seed_chain_dir)
             pdbutils.split_pdb(seed_pdb, seed_chain_dir)
-            self.full_sse_list = [seed_chain_dir + '/' + f for f in 
-                                  os.listdir(seed_chain_dir)
-                                  if 'chain_' in f]
-            self.full_sse_list.sort()
+            self.full_sse_list = pdbutils.list_chain_pdbs(seed_chain_dir)
             if query_pdb:
                 pdbutils.merge_pdbs([query_pdb, seed_pdb], _seed_pdb)
             else:
-                pdbutils.merge_pdbs([seed_pdb], _seed_pdb, set_bfac=np.log(min_nbrs))      
+                pdbutils.merge_pdbs([seed_pdb], _seed_pdb, set_bfac=log_nbrs)      
         elif query_pdb:
-            pdbutils.merge_pdbs([query_pdb], _seed_pdb, set_bfac=np.log(min_nbrs))
+            pdbutils.merge_pdbs([query_pdb], _seed_pdb, set_bfac=log_nbrs)
             self.full_sse_list = []
         self.seed_pdb = _seed_pdb        
         if not query_pdb and not seed_pdb:
@@ -72,7 +68,7 @@ class SSE:
         if exclusion_pdb:
             _exclusion_pdb = _workdir + '/exclusion.pdb'
             pdbutils.merge_pdbs([_seed_pdb, exclusion_pdb], _exclusion_pdb, 
-                                set_bfac=np.log(min_nbrs))
+                                set_bfac=log_nbrs)
             self.orig_exclusion = exclusion_pdb
         else:
             _exclusion_pdb = _seed_pdb
@@ -7,7 +7,7 @@ sys.path.append(r'/mnt/e/GitHub_Design/smallprot')
 
 print('Thanks for using smallprot!')
 
-from smallprot import smallprot_config, loop_sse
+from smallprot import smallprot_config
 
 para = smallprot_config.Parameter(
         ###Database
@@ -33,13 +33,21 @@ exclusion_pdb = None
 workdir = '/mnt/e/DesignData/smallprot_loops/nina/output_test_build2/'
 
 
-hhh = loop_sse.Loop_sse(seed_pdb, query_pdb, exclusion_pdb,  workdir, para)
-# n_truncations=list(range(20))  ## from 0 to 19
-# c_truncations=list(range(10))  ## from 0 to 9
-# n_truncations = [16, 17, 18, 19]
-# c_truncations = [1, 2, 3, 4, 5, 6, 7, 8, 9]
-n_truncations = [16]
-c_truncations = [1]
-direction=[2, 1, 0, 3]
-# direction = []
-hhh.loop_structure(direction = direction, n_truncations = n_truncations, c_truncations = c_truncations)
\ No newline at end of file
+def main():
+    # the loop building modules pull in numpy, prody and qbits, so they 
+    # are only imported once the script actually runs
+    from smallprot import loop_sse
+    hhh = loop_sse.Loop_sse(seed_pdb, query_pdb, exclusion_pdb,  workdir, para)
+    # n_truncations=list(range(20))  ## from 0 to 19
+    # c_truncations=list(range(10))  ## from 0 to 9
+    # n_truncations = [16, 17, 18, 19]
+    # c_truncations = [1, 2, 3, 4, 5, 6, 7, 8, 9]
+    n_truncations = [16]
+    c_truncations = [1]
+    direction=[2, 1, 0, 3]
+    # direction = []
+    hhh.loop_structure(direction = direction, n_truncations = n_truncations, c_truncations = c_truncations)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,7 @@ sys.path.append(r'/mnt/e/GitHub_Design/smallprot')
 
 print('Thanks for using smallprot!')
 
-from smallprot import smallprot, smallprot_config
+from smallprot import smallprot_config
 
 para = smallprot_config.Parameter(
         num_iter = 2, 
@@ -40,8 +40,17 @@ exclusion_pdb = None
 
 workdir = '/mnt/e/DesignData/smallprot/2a3d/output_build/'
 
-hhh = smallprot.SmallProt(seed_pdb, query_pdb, exclusion_pdb,  workdir, para)
-#n_truncations=list(range(5))
-#c_truncations=list(range(5))
-#hhh.build_protein(n_truncations = n_truncations, c_truncations = c_truncations)
-hhh.build_protein()
\ No newline at end of file
+
+def main():
+    # SmallProt builds the final proteins in a process pool, so the run 
+    # must be guarded for the spawn start method (e.g. macOS)
+    from smallprot import smallprot
+    hhh = smallprot.SmallProt(seed_pdb, query_pdb, exclusion_pdb,  workdir, para)
+    #n_truncations=list(range(5))
+    #c_truncations=list(range(5))
+    #hhh.build_protein(n_truncations = n_truncations, c_truncations = c_truncations)
+    hhh.build_protein()
+
+
+if __name__ == '__main__':
+    main()
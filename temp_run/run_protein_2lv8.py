@@ -7,7 +7,7 @@ sys.path.append(r'/mnt/e/GitHub_Design/smallprot')
 
 print('Thanks for using smallprot!')
 
-from smallprot import smallprot, smallprot_config
+from smallprot import smallprot_config
 
 para = smallprot_config.Parameter(
         num_iter = 1, 
@@ -41,8 +41,17 @@ exclusion_pdb = '/mnt/e/DesignData/lhl/exclude.pdb'
 
 workdir = '/mnt/e/DesignData/lhl/output_top100/'
 
-hhh = smallprot.SmallProt(seed_pdb, query_pdb, exclusion_pdb,  workdir, para)
-#n_truncations=list(range(5))
-#c_truncations=list(range(5))
-#hhh.build_protein(n_truncations = n_truncations, c_truncations = c_truncations)
-hhh.build_protein()
\ No newline at end of file
+
+def main():
+    # SmallProt builds the final proteins in a process pool, so the run 
+    # must be guarded for the spawn start method (e.g. macOS)
+    from smallprot import smallprot
+    hhh = smallprot.SmallProt(seed_pdb, query_pdb, exclusion_pdb,  workdir, para)
+    #n_truncations=list(range(5))
+    #c_truncations=list(range(5))
+    #hhh.build_protein(n_truncations = n_truncations, c_truncations = c_truncations)
+    hhh.build_protein()
+
+
+if __name__ == '__main__':
+    main()
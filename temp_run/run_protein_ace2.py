@@ -7,8 +7,6 @@ sys.path.append(r'/mnt/e/GitHub_Design/smallprot')
 
 print('Thanks for using smallprot!')
 
-from smallprot import smallprot 
-
 seed_pdb = '/mnt/e/GitHub_Design/smallprot/data/ace2_input/query.pdb'
 query_pdb = None
 exclusion_pdb = '/mnt/e/GitHub_Design/smallprot/data/ace2_input/exclusion.pdb'
@@ -16,8 +14,17 @@ exclusion_pdb = '/mnt/e/GitHub_Design/smallprot/data/ace2_input/exclusion.pdb'
 workdir = '/mnt/e/GitHub_Design/smallprot/data/ace2_input/output_build_3helix_test/'
 para = '/mnt/e/GitHub_Design/smallprot/parameter_loop_truc.ini'
 
-hhh = smallprot.SmallProt(seed_pdb, query_pdb, exclusion_pdb,  workdir, para)
-#n_truncations=list(range(5))
-#c_truncations=list(range(5))
-#hhh.build_protein(n_truncations = n_truncations, c_truncations = c_truncations)
-hhh.build_protein()
\ No newline at end of file
+
+def main():
+    # SmallProt builds the final proteins in a process pool, so the run 
+    # must be guarded for the spawn start method (e.g. macOS)
+    from smallprot import smallprot
+    hhh = smallprot.SmallProt(seed_pdb, query_pdb, exclusion_pdb,  workdir, para)
+    #n_truncations=list(range(5))
+    #c_truncations=list(range(5))
+    #hhh.build_protein(n_truncations = n_truncations, c_truncations = c_truncations)
+    hhh.build_protein()
+
+
+if __name__ == '__main__':
+    main()
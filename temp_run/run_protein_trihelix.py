@@ -7,7 +7,7 @@ sys.path.append(r'/mnt/e/GitHub_Design/smallprot')
 
 print('Thanks for using smallprot!')
 
-from smallprot import smallprot, smallprot_config
+from smallprot import smallprot_config
 
 para = smallprot_config.Parameter(
         num_iter = 2, 
@@ -40,9 +40,18 @@ exclusion_pdb = None
 
 workdir = '/mnt/e/DesignData/smallprot/trihelix/output_top20'
 
-hhh = smallprot.SmallProt(seed_pdb, query_pdb, exclusion_pdb,  workdir, para)
 
-hhh.build_protein()
+def main():
+    # SmallProt builds the final proteins in a process pool, so the run 
+    # must be guarded for the spawn start method (e.g. macOS)
+    from smallprot import smallprot
+    hhh = smallprot.SmallProt(seed_pdb, query_pdb, exclusion_pdb,  workdir, para)
+
+    hhh.build_protein()
+
+
+if __name__ == '__main__':
+    main()
 
 '''
 hhh.pre_build_pdbs_summary[0]
@@ -58,4 +67,4 @@ filename = hhh.workdir + '/protein_build_summary.txt'
 hhh._write_protein_summary(filename, hhh.pre_build_pdbs, hhh.pre_build_pdbs_summary)
 
 
-'''
\ No newline at end of file
+'''
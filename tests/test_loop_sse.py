@@ -0,0 +1,54 @@
+import os
+from unittest import mock
+
+import pytest
+
+# loop_sse imports the full design stack
+for _module in ('prody', 'qbits', 'Bio', 'logomaker', 'matplotlib', 'pandas', 'fpdf'):
+    pytest.importorskip(_module)
+
+from smallprot import loop_sse, smallprot_config
+
+
+def _write_loop_pdb(path, n_res):
+    with open(path, 'w') as f:
+        for r in range(n_res):
+            f.write('ATOM  {:5d}  CA  ALA A{:4d}      0.000   0.000   0.000\n'.format(r + 1, r + 1))
+
+
+def test_fresh_master_output_is_clustered(tmp_path):
+    '''
+    Loops sorted into new length directories after a MASTER query must be clustered.
+    '''
+    para = smallprot_config.Parameter(loop_query_win=7)
+    loop_workdir = str(tmp_path / 'loops_A_B')
+
+    def fake_master_query_loop(loop_query, targetList, outdir=None, outfile=None, **kwargs):
+        # two loops of length 3 and one of length 5, plus the query ends
+        for i, n_res in enumerate([17, 17, 19]):
+            _write_loop_pdb(outdir + '/wgap{}.pdb'.format(i + 1), n_res)
+        open(outfile, 'w').close()
+
+    with mock.patch.object(loop_sse.query, 'master_query_loop', fake_master_query_loop), \
+         mock.patch.object(loop_sse.pdbutils, 'gen_loop_query_win'), \
+         mock.patch.object(loop_sse.cluster_loops, 'run_cluster') as run_cluster:
+        loop_sse._loop_search_one_pair([], None, loop_workdir, 0, 1, [3, 20], para, None, None)
+
+    assert run_cluster.call_count == 1
+    assert sorted(os.listdir(loop_workdir + '/3')) == ['clusters', 'wgap1.pdb', 'wgap2.pdb']
+    assert sorted(os.listdir(loop_workdir + '/5')) == ['clusters', 'wgap3.pdb']
+
+
+def test_existing_clusters_are_not_rerun(tmp_path):
+    para = smallprot_config.Parameter(loop_query_win=7)
+    loop_workdir = tmp_path / 'loops_A_B'
+    (loop_workdir / '3' / 'clusters').mkdir(parents=True)
+    (loop_workdir / 'stdout').write_text('')
+
+    with mock.patch.object(loop_sse.query, 'master_query_loop') as master_query_loop, \
+         mock.patch.object(loop_sse.pdbutils, 'gen_loop_query_win'), \
+         mock.patch.object(loop_sse.cluster_loops, 'run_cluster') as run_cluster:
+        loop_sse._loop_search_one_pair([], None, str(loop_workdir), 0, 1, [3, 20], para, None, None)
+
+    master_query_loop.assert_not_called()
+    run_cluster.assert_not_called()